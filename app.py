@@ -3,25 +3,138 @@ from flask import Flask, render_template, request, jsonify, send_file
 import numpy as np
 from shapely import wkt
 from shapely.geometry import Polygon, Point
-from scipy.ndimage import distance_transform_edt
+from shapely.ops import polylabel
+import cv2
+from PIL import Image, ImageDraw
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:  # Numba is optional; rasterize with PIL instead
+    HAS_NUMBA = False
+    def njit(*args, **kwargs):
+        return lambda func: func
 from skimage.morphology import medial_axis
 import matplotlib
 matplotlib.use('Agg')  # Important for server
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.patches import Polygon as MplPolygon
 import io
 import base64
 import json
+import threading
+from collections import OrderedDict
 
 app = Flask(__name__)
 
+# Result figures are built once and redrawn for every request. They are
+# plain Figures (no pyplot global state), each with its own lock, so a
+# 2-panel and a 3-panel render can run at the same time
+_FIG_2 = Figure(figsize=(14, 6), facecolor='white')
+_AX_2 = _FIG_2.subplots(1, 2)
+_FIG_2.subplots_adjust(left=0.02, right=0.98, bottom=0.02, top=0.92, wspace=0.05)
+_FIG_2_LOCK = threading.Lock()
+_FIG_3 = Figure(figsize=(18, 5), facecolor='white')
+_AX_3 = _FIG_3.subplots(1, 3)
+_FIG_3.subplots_adjust(left=0.02, right=0.98, bottom=0.02, top=0.80, wspace=0.05)
+_FIG_3_LOCK = threading.Lock()
+
+IMAGE_FORMATS = ('png', 'svg')
+
+def _figure_to_base64(fig, output_format='png'):
+    """Save a figure as base64-encoded PNG or SVG"""
+    buf = io.BytesIO()
+    if output_format == 'svg':
+        # Vector output skips Agg rasterization entirely
+        fig.savefig(buf, format='svg')
+    else:
+        # Fast zlib level; size matters less than CPU
+        fig.savefig(buf, format='png', dpi=90,
+                    pil_kwargs={'optimize': False, 'compress_level': 1})
+    return base64.b64encode(buf.getvalue()).decode('utf-8')
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of serialized JSON responses, so identical
+    re-submitted requests skip geometry and rendering entirely
+    """
+    
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Return the cached JSON string for key, or None"""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+    
+    def put(self, key, body):
+        """Store a JSON string, evicting the least recently used entry"""
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+def _json_response(body):
+    """Wrap an already-serialized JSON string in a response"""
+    return app.response_class(body, mimetype='application/json')
+
+def _polygon_edges(coords):
+    """
+    Split a closed ring into its edges as four contiguous float32 arrays
+    (x0, y0, x1, y1), one entry per edge
+    """
+    ring = np.asarray(coords, dtype=np.float32)
+    return (np.ascontiguousarray(ring[:-1, 0]), np.ascontiguousarray(ring[:-1, 1]),
+            np.ascontiguousarray(ring[1:, 0]), np.ascontiguousarray(ring[1:, 1]))
+
+@njit(cache=True)
+def _rasterize_scanline(x0, y0, x1, y1, width, height):
+    """
+    Scanline polygon fill: a pixel (x, y) is inside when it lies between
+    a pair of sorted edge crossings of row y (even-odd rule).
+    
+    Args:
+        x0, y0, x1, y1: Edge arrays from _polygon_edges, in raster coordinates
+        width, height: Raster size in pixels
+    
+    Returns:
+        (height, width) bool raster
+    """
+    raster = np.zeros((height, width), dtype=np.bool_)
+    n_edges = x0.shape[0]
+    crossings = np.empty(n_edges, dtype=np.float64)
+    
+    for y in range(height):
+        # Collect x-intersections of this row with every edge
+        count = 0
+        for i in range(n_edges):
+            if (y0[i] <= y) != (y1[i] <= y):
+                crossings[count] = x0[i] + (y - y0[i]) * (x1[i] - x0[i]) / (y1[i] - y0[i])
+                count += 1
+        
+        # Fill pixels in [x_i, x_{i+1}) for each pair of crossings
+        row = np.sort(crossings[:count])
+        for k in range(0, count - 1, 2):
+            start = max(int(np.ceil(row[k])), 0)
+            end = min(int(np.ceil(row[k + 1])), width)
+            for x in range(start, end):
+                raster[y, x] = True
+    
+    return raster
+
 class RiverLabeler:
     """Simple river labeling using distance transform"""
     
     def __init__(self):
         self.padding = 5
+        self.max_raster_size = 512
     
-    def place_label(self, coordinates, label_text, font_size):
+    def place_label(self, coordinates, label_text, font_size, polygon=None):
         """
         Main function: Place label on river
         
@@ -29,6 +142,7 @@ class RiverLabeler:
             coordinates: List of [x,y] points like [[0,0], [10,10], ...]
             label_text: Text to place
             font_size: Font size in points
+            polygon: Optional Polygon already built from coordinates
         
         Returns:
             Dictionary with placement info
@@ -37,7 +151,7 @@ class RiverLabeler:
         if len(coordinates) < 3:
             return {"error": "Need at least 3 points"}
         
-        river_poly = Polygon(coordinates)
+        river_poly = polygon if polygon is not None else Polygon(coordinates)
         
         # Estimate text dimensions
         text_width = len(label_text) * font_size * 0.6
@@ -54,26 +168,77 @@ class RiverLabeler:
         return result
     
     def _find_widest_point(self, polygon, text_width, text_height):
-        """Find the widest part of the river"""
+        """
+        Find the widest part of the river
+        
+        The widest point is the maximum of the polygon's distance
+        transform (the pole of inaccessibility). polylabel finds it exactly
+        from the geometry, without rasterizing; callers that need the whole
+        distance field use _distance_map.
+        """
+        ring = np.asarray(polygon.exterior.coords)
+        
+        # Triangles have a closed-form answer: the incenter, at inradius
+        # distance from every edge
+        if len(ring) == 4 and not polygon.interiors:
+            a, b, c = ring[:3]
+            side_a = np.linalg.norm(b - c)
+            side_b = np.linalg.norm(c - a)
+            side_c = np.linalg.norm(a - b)
+            perimeter = side_a + side_b + side_c
+            if perimeter > 0:
+                optimal_x, optimal_y = (side_a * a + side_b * b + side_c * c) / perimeter
+                max_dist = 2 * polygon.area / perimeter
+                return self._placement_result(polygon, optimal_x, optimal_y, max_dist,
+                                              text_width, text_height)
+        
+        pole = polylabel(polygon, tolerance=1.0)
+        max_dist = polygon.boundary.distance(pole)
+        
+        return self._placement_result(polygon, pole.x, pole.y, max_dist,
+                                      text_width, text_height)
+    
+    def _distance_map(self, polygon):
+        """
+        Rasterize the polygon and compute its distance transform, for
+        callers that need the whole distance field rather than its maximum
+        
+        Returns:
+            Tuple (distances, minx, miny, scale), where raster pixel
+            (row, col) maps to (col*scale + minx, row*scale + miny)
+        """
         
         # Get bounds
         minx, miny, maxx, maxy = polygon.bounds
-        width = int(maxx - minx) + 20
-        height = int(maxy - miny) + 20
         
-        # Convert to raster
-        raster = self._polygon_to_raster(polygon, width, height, minx, miny)
+        # Cap the raster at ~512px on its long side; sub-unit placement
+        # accuracy is meaningless for large polygons
+        scale = max(1.0, max(maxx - minx, maxy - miny) / self.max_raster_size)
+        
+        # Snap the raster to the pixel grid around the bounds, with a thin
+        # background margin on every side so the EDT sees the boundary
+        margin = 2
+        col0, col1 = np.floor(minx / scale), np.ceil(maxx / scale)
+        row0, row1 = np.floor(miny / scale), np.ceil(maxy / scale)
+        width = int(col1 - col0) + 2 * margin + 1
+        height = int(row1 - row0) + 2 * margin + 1
+        minx = (col0 - margin) * scale
+        miny = (row0 - margin) * scale
         
-        # Distance transform
-        distances = distance_transform_edt(raster)
+        # Convert to raster
+        raster = self._polygon_to_raster(polygon, width, height, minx, miny, scale)
         
-        # Find maximum distance point (widest part)
-        max_dist = distances.max()
-        widest_idx = np.unravel_index(distances.argmax(), distances.shape)
+        # Distance transform (OpenCV's precise L2 EDT). Keep it float32:
+        # the threshold pass over the map then moves half the bytes of float64
+        distances = cv2.distanceTransform(np.ascontiguousarray(raster.view(np.uint8)),
+                                          cv2.DIST_L2, cv2.DIST_MASK_PRECISE,
+                                          dstType=cv2.CV_32F)
         
-        # Convert back to original coordinates
-        optimal_x = widest_idx[1] + minx
-        optimal_y = widest_idx[0] + miny
+        return distances, minx, miny, scale
+    
+    def _placement_result(self, polygon, optimal_x, optimal_y, max_dist,
+                          text_width, text_height):
+        """Build the placement dict for a chosen widest point"""
         
         # Naive centroid for comparison
         centroid = polygon.centroid
@@ -92,54 +257,53 @@ class RiverLabeler:
             'improvement': float(np.sqrt((optimal_x-naive_x)**2 + (optimal_y-naive_y)**2))
         }
     
-    def _polygon_to_raster(self, polygon, width, height, offset_x, offset_y):
-        """Convert polygon to binary raster"""
-        from matplotlib.path import Path
-        
-        raster = np.zeros((height, width), dtype=bool)
+    def _polygon_to_raster(self, polygon, width, height, offset_x, offset_y, scale=1.0):
+        """Convert polygon to binary raster (one pixel per `scale` units)"""
         coords = np.array(polygon.exterior.coords)
         coords[:, 0] -= offset_x
         coords[:, 1] -= offset_y
+        coords /= scale
         
-        y, x = np.mgrid[:height, :width]
-        points = np.vstack((x.flatten(), y.flatten())).T
-        path = Path(coords)
-        mask = path.contains_points(points)
+        if HAS_NUMBA:
+            return _rasterize_scanline(*_polygon_edges(coords), width, height)
         
-        return mask.reshape(height, width)
+        # Without Numba, PIL's C scanline fill is the next fastest option
+        img = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(img).polygon([tuple(p) for p in coords], outline=1, fill=1)
+        return np.asarray(img, dtype=bool)
     
-    def create_visualization(self, result):
-        """Create before/after comparison image"""
-        
-        coords = result['polygon_coords']
-        polygon = Polygon(coords)
+    def create_visualization(self, result, polygon=None, output_format='png'):
+        """Create before/after comparison image (base64 PNG or SVG)"""
         
-        # Create figure with 2 subplots
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
+        if polygon is None:
+            polygon = Polygon(result['polygon_coords'])
         
-        # Plot 1: Naive (centroid)
-        self._plot_method(ax1, polygon, result['naive_x'], result['naive_y'],
-                         result['text'], result['font_size'], "Naive (Centroid)", 'red')
+        # Extract the outline once and share it between both panels
+        ring = np.asarray(polygon.exterior.coords)
+        xs, ys = ring[:, 0], ring[:, 1]
         
-        # Plot 2: Optimal (our method)
-        self._plot_method(ax2, polygon, result['optimal_x'], result['optimal_y'],
-                         result['text'], result['font_size'], "Optimal (Distance Transform)", 'green')
-        
-        plt.tight_layout()
-        
-        # Convert to base64 for web display
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-        buf.seek(0)
-        img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        plt.close()
+        with _FIG_2_LOCK:
+            # Reuse the shared 2-panel figure (fixed margins, no tight_layout)
+            ax1, ax2 = _AX_2
+            ax1.clear()
+            ax2.clear()
+            
+            # Plot 1: Naive (centroid)
+            self._plot_method(ax1, xs, ys, result['naive_x'], result['naive_y'],
+                             result['text'], result['font_size'], "Naive (Centroid)", 'red')
+            
+            # Plot 2: Optimal (our method)
+            self._plot_method(ax2, xs, ys, result['optimal_x'], result['optimal_y'],
+                             result['text'], result['font_size'], "Optimal (Distance Transform)", 'green')
+            
+            # Convert to base64 for web display
+            img_base64 = _figure_to_base64(_FIG_2, output_format)
         
         return img_base64
     
-    def _plot_method(self, ax, polygon, x, y, text, font_size, title, color):
+    def _plot_method(self, ax, xs, ys, x, y, text, font_size, title, color):
         """Helper to plot one method"""
         # Draw polygon
-        xs, ys = polygon.exterior.xy
         ax.fill(xs, ys, color='lightblue', edgecolor='blue', linewidth=2)
         
         # Draw label
@@ -156,6 +320,7 @@ class RiverLabeler:
 
 # Initialize labeler
 labeler = RiverLabeler()
+place_label_cache = ResultCache()
 
 @app.route('/')
 def index():
@@ -172,15 +337,31 @@ def place_label_api():
         coordinates = data.get('coordinates', [])
         label_text = data.get('label_text', 'RIVER')
         font_size = int(data.get('font_size', 24))
+        output_format = data.get('output_format', 'png')
+        if output_format not in IMAGE_FORMATS:
+            output_format = 'png'
+        
+        # Serve repeated requests from the cache
+        cache_key = (tuple(map(tuple, coordinates)), label_text, font_size, output_format)
+        cached = place_label_cache.get(cache_key)
+        if cached is not None:
+            return _json_response(cached)
+        
+        # Build the polygon once and share it with the visualization
+        polygon = Polygon(coordinates) if len(coordinates) >= 3 else None
         
         # Process
-        result = labeler.place_label(coordinates, label_text, font_size)
+        result = labeler.place_label(coordinates, label_text, font_size, polygon)
+        if 'error' in result:
+            return jsonify(result)
         
         # Create visualization
-        if 'error' not in result:
-            result['image'] = labeler.create_visualization(result)
+        result['image'] = labeler.create_visualization(result, polygon, output_format)
+        result['image_format'] = output_format
         
-        return jsonify(result)
+        body = app.json.dumps(result)
+        place_label_cache.put(cache_key, body)
+        return _json_response(body)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -197,7 +378,7 @@ class MultiAlgorithmLabeler:
     Compare multiple label placement algorithms
     """
     
-    def compare_algorithms(self, coordinates, label_text, font_size):
+    def compare_algorithms(self, coordinates, label_text, font_size, output_format='png'):
         """
         Run all algorithms and compare results
         """
@@ -208,7 +389,7 @@ class MultiAlgorithmLabeler:
         results = {
             'text': label_text,
             'font_size': font_size,
-            'polygon_coords': coordinates
+            'polygon_coords': np.asarray(coordinates).tolist()
         }
         
         # Algorithm 1: Naive Centroid
@@ -221,7 +402,8 @@ class MultiAlgorithmLabeler:
             'method': 'Geometric center only'
         }
         
-        # Algorithm 2: Distance Transform (your existing method)
+        # Algorithm 2: Distance Transform (your existing method), same
+        # widest-point search as /api/place-label
         labeler = RiverLabeler()
         dt_result = labeler._find_widest_point(polygon, text_width, text_height)
         results['distance_transform'] = {
@@ -233,25 +415,26 @@ class MultiAlgorithmLabeler:
         }
         
         # Algorithm 3: Weighted Centroid (bonus - quick implementation)
-        # Find centroid of points with distance > threshold
-        minx, miny, maxx, maxy = polygon.bounds
-        width = int(maxx - minx) + 20
-        height = int(maxy - miny) + 20
-        
-        raster = labeler._polygon_to_raster(polygon, width, height, minx, miny)
-        distances = distance_transform_edt(raster)
-        
-        # Find all points with distance > 50th percentile (guard empty interior)
+        # Find centroid of points with distance > threshold on the raster
+        # distance map
+        distances, minx, miny, scale = labeler._distance_map(polygon)
+        # Find all points with distance > median (guard empty interior);
+        # np.partition selects the median in O(N) without a full sort
         interior = distances[distances > 0]
         if len(interior) > 0:
-            threshold = np.percentile(interior, 50)
-            good_points = np.argwhere(distances > threshold)
+            mid = len(interior) // 2
+            threshold = np.partition(interior, mid)[mid]
+            mask = distances > threshold
+            total = mask.sum()
         else:
-            good_points = np.array([])
-        
-        if len(good_points) > 0:
-            weighted_y = good_points[:, 0].mean() + miny
-            weighted_x = good_points[:, 1].mean() + minx
+            total = 0
+        
+        if total > 0:
+            # Mean row/column from per-axis counts, without an index array
+            row_counts = mask.sum(axis=1)
+            col_counts = mask.sum(axis=0)
+            weighted_y = (row_counts @ np.arange(len(row_counts))) / total * scale + miny
+            weighted_x = (col_counts @ np.arange(len(col_counts))) / total * scale + minx
         else:
             weighted_y = centroid.y
             weighted_x = centroid.x
@@ -273,57 +456,58 @@ class MultiAlgorithmLabeler:
         results['winner'] = winner
         
         # Create comparison visualization
-        results['comparison_image'] = self._create_comparison_viz(polygon, results)
+        results['comparison_image'] = self._create_comparison_viz(polygon, results, output_format)
+        results['image_format'] = output_format
         
         return results
     
-    def _create_comparison_viz(self, polygon, results):
+    def _create_comparison_viz(self, polygon, results, output_format='png'):
         """Create 3-panel comparison visualization"""
-        fig, axes = plt.subplots(1, 3, figsize=(18, 5))
-        
         methods = ['centroid', 'distance_transform', 'weighted']
         colors = ['red', 'green', 'blue']
         
-        for idx, (method, color) in enumerate(zip(methods, colors)):
-            ax = axes[idx]
-            data = results[method]
+        # Extract the outline once and share it between all panels
+        ring = np.asarray(polygon.exterior.coords)
+        xs, ys = ring[:, 0], ring[:, 1]
+        
+        with _FIG_3_LOCK:
+            # Reuse the shared 3-panel figure (fixed margins, no tight_layout)
+            for idx, (method, color) in enumerate(zip(methods, colors)):
+                ax = _AX_3[idx]
+                ax.clear()
+                data = results[method]
+                
+                # Draw polygon
+                ax.fill(xs, ys, color='lightblue', edgecolor='blue', linewidth=2, alpha=0.5)
+                
+                # Draw label
+                winner_marker = '⭐ ' if results['winner'] == method else ''
+                ax.text(data['x'], data['y'], results['text'],
+                       fontsize=results['font_size'], ha='center', va='center',
+                       color=color, fontweight='bold',
+                       bbox=dict(boxstyle='round', facecolor='yellow', alpha=0.8))
+                
+                # Draw point
+                ax.plot(data['x'], data['y'], 'o', color=color, markersize=10)
+                
+                # Title with distance
+                ax.set_title(f"{winner_marker}{data['name']}\n"
+                            f"Edge Distance: {data['distance_to_edge']:.1f}pt",
+                            fontsize=12, fontweight='bold')
+                ax.set_aspect('equal')
+                ax.axis('off')
             
-            # Draw polygon
-            xs, ys = polygon.exterior.xy
-            ax.fill(xs, ys, color='lightblue', edgecolor='blue', linewidth=2, alpha=0.5)
+            _FIG_3.suptitle('Algorithm Comparison: Which Places Label Better?',
+                            fontsize=16, fontweight='bold', y=0.98)
             
-            # Draw label
-            winner_marker = '⭐ ' if results['winner'] == method else ''
-            ax.text(data['x'], data['y'], results['text'],
-                   fontsize=results['font_size'], ha='center', va='center',
-                   color=color, fontweight='bold',
-                   bbox=dict(boxstyle='round', facecolor='yellow', alpha=0.8))
-            
-            # Draw point
-            ax.plot(data['x'], data['y'], 'o', color=color, markersize=10)
-            
-            # Title with distance
-            ax.set_title(f"{winner_marker}{data['name']}\n"
-                        f"Edge Distance: {data['distance_to_edge']:.1f}pt",
-                        fontsize=12, fontweight='bold')
-            ax.set_aspect('equal')
-            ax.axis('off')
-        
-        plt.suptitle('Algorithm Comparison: Which Places Label Better?',
-                    fontsize=16, fontweight='bold', y=0.98)
-        plt.tight_layout()
-        
-        # Convert to base64
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=120, bbox_inches='tight')
-        buf.seek(0)
-        img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        plt.close()
+            # Convert to base64
+            img_base64 = _figure_to_base64(_FIG_3, output_format)
         
         return img_base64
 
 # Initialize multi-algorithm labeler
 multi_labeler = MultiAlgorithmLabeler()
+comparison_cache = ResultCache()
 
 # Add new API endpoint (POST for comparison; GET so the route is clearly registered)
 @app.route('/api/compare-algorithms', methods=['GET', 'POST'])
@@ -331,7 +515,7 @@ def compare_algorithms_api():
     """API endpoint for algorithm comparison. Use POST with JSON body."""
     if request.method == 'GET':
         return jsonify({
-            'message': 'Use POST with JSON: coordinates, label_text, font_size',
+            'message': 'Use POST with JSON: coordinates, label_text, font_size, output_format (png|svg)',
             'example': {'coordinates': [[0, 0], [100, 50], [200, 0]], 'label_text': 'RIVER', 'font_size': 24}
         })
     try:
@@ -340,21 +524,39 @@ def compare_algorithms_api():
         # Normalize: accept [{x,y}] from frontend or [[x,y]], ensure numbers
         if not coordinates:
             return jsonify({'error': 'No coordinates provided.'}), 400
+        # Build an (N, 2) float array directly instead of per-point lists
         if isinstance(coordinates[0], dict):
-            coordinates = [[float(p['x']), float(p['y'])] for p in coordinates]
+            coordinates = np.fromiter((v for p in coordinates for v in (p['x'], p['y'])),
+                                      dtype=np.float64, count=2 * len(coordinates)).reshape(-1, 2)
         else:
-            coordinates = [[float(p[0]), float(p[1])] for p in coordinates]
+            coordinates = np.asarray(coordinates, dtype=np.float64)
+            if coordinates.ndim != 2 or coordinates.shape[1] < 2:
+                return jsonify({'error': 'Coordinates must be [x, y] pairs.'}), 400
+            coordinates = coordinates[:, :2]
+        if not np.isfinite(coordinates).all():
+            return jsonify({'error': 'Coordinates must be finite numbers.'}), 400
         label_text = (data.get('label_text') or 'RIVER').strip() or 'RIVER'
         font_size = int(data.get('font_size', 24))
         if font_size < 1 or font_size > 200:
             font_size = 24
+        output_format = data.get('output_format', 'png')
+        if output_format not in IMAGE_FORMATS:
+            output_format = 'png'
         if len(coordinates) < 3:
             return jsonify({'error': 'Need at least 3 points to form a river polygon.'}), 400
         
+        # Serve repeated requests from the cache
+        cache_key = (np.ascontiguousarray(coordinates).tobytes(), label_text, font_size, output_format)
+        cached = comparison_cache.get(cache_key)
+        if cached is not None:
+            return _json_response(cached)
+        
         # Compare algorithms
-        results = multi_labeler.compare_algorithms(coordinates, label_text, font_size)
+        results = multi_labeler.compare_algorithms(coordinates, label_text, font_size, output_format)
         
-        return jsonify(results)
+        body = app.json.dumps(results)
+        comparison_cache.put(cache_key, body)
+        return _json_response(body)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 400
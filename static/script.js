@@ -194,7 +194,8 @@ async function placeLabel() {
             body: JSON.stringify({
                 coordinates: points,
                 label_text: labelText,
-                font_size: fontSize
+                font_size: fontSize,
+                output_format: 'svg'
             })
         });
         
@@ -278,7 +279,8 @@ async function compareAlgorithms() {
             body: JSON.stringify({
                 coordinates: points,
                 label_text: labelText,
-                font_size: fontSize
+                font_size: fontSize,
+                output_format: 'svg'
             })
         });
         
@@ -353,7 +355,7 @@ function displayResults(result) {
         document.getElementById('visualizationSection').style.display = 'block';
         document.getElementById('visualizationSection').querySelector('h2').textContent = 
             '3. Comparison: Naive vs Optimal';
-        document.getElementById('resultImage').src = 'data:image/png;base64,' + result.image;
+        document.getElementById('resultImage').src = imageDataUri(result.image, result.image_format);
         
         // Scroll to results
         document.getElementById('visualizationSection').scrollIntoView({ 
@@ -419,7 +421,7 @@ function displayComparisonResults(result) {
         document.getElementById('visualizationSection').style.display = 'block';
         document.getElementById('visualizationSection').querySelector('h2').textContent = 
             '3. Visual Comparison: All 3 Algorithms';
-        document.getElementById('resultImage').src = 'data:image/png;base64,' + result.comparison_image;
+        document.getElementById('resultImage').src = imageDataUri(result.comparison_image, result.image_format);
         
         document.getElementById('visualizationSection').scrollIntoView({ 
             behavior: 'smooth', 
@@ -428,6 +430,14 @@ function displayComparisonResults(result) {
     }
 }
 
+/**
+ * Build a data URI for a base64 image returned by the API
+ */
+function imageDataUri(base64Image, format) {
+    const mime = format === 'svg' ? 'image/svg+xml' : 'image/png';
+    return `data:${mime};base64,${base64Image}`;
+}
+
 /**
  * Download the comparison image
  */
@@ -437,7 +447,8 @@ function downloadImage() {
     
     // Create download link
     const link = document.createElement('a');
-    link.download = `${labelText.toLowerCase()}_river_labeling_comparison.png`;
+    const extension = img.src.startsWith('data:image/svg+xml') ? 'svg' : 'png';
+    link.download = `${labelText.toLowerCase()}_river_labeling_comparison.${extension}`;
     link.href = img.src;
     link.click();
     